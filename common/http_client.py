@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: GPL-2.0-or-later OR MIT
+
+"""
+Shared HTTP client for the Python scripts in servers/, home/ and deprecated/.
+
+Requirements:
+    pip install requests
+
+Usage from a script one level below the repository root:
+
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "common"))
+    import http_client
+
+    session = http_client.make_session(pool_size=8)
+    response = session.get(url)                   # pooled, with timeout and retries
+    http_client.download(session, url, path)      # conditional GET into a file
+    http_client.download(session, url, path, store=my_store, resume=True,
+                         on_chunk=digest.update)  # own validator storage, resumable
+
+Notes:
+- Connections are kept alive and pooled per host (pool_size).
+- Every request gets DEFAULT_TIMEOUT unless a timeout is passed explicitly,
+  so a stalled socket cannot hang a cron job forever.
+- 429 and 5xx responses and connection errors are retried with exponential
+  backoff; Retry-After from the server is honoured.
+- download() keeps ETag/Last-Modified in a <file>.meta sidecar by default;
+  pass any object with load_validators/save_validators/complete_validators
+  (see SidecarValidators) to keep them elsewhere, e.g. in a database.
+- Set HTTP_TIMING=1 in the environment to log method, URL, status and
+  latency of every request to stderr, or pass your own hooks.
+"""
+
+import json
+import os
+import sys
+from email.utils import formatdate
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# (connect, read) timeouts in seconds
+DEFAULT_TIMEOUT = (10, 60)
+DEFAULT_POOL_SIZE = 10
+DEFAULT_RETRIES = 5
+# Sleeps between retries: 0.5, 1, 2, 4... seconds unless Retry-After says otherwise
+BACKOFF_FACTOR = 0.5
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+CHUNK_SIZE = 64 * 1024
+
+
+class TimeoutSession(requests.Session):
+    """requests.Session that applies a default timeout to every request."""
+
+    def __init__(self, timeout: Tuple[float, float] = DEFAULT_TIMEOUT):
+        super().__init__()
+        self.timeout = timeout
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return super().request(method, url, **kwargs)
+
+
+def log_timing(response: requests.Response, *args, **kwargs) -> None:
+    """Response hook: print request latency to stderr."""
+    elapsed_ms = response.elapsed.total_seconds() * 1000
+    print(
+        f"[http] {response.request.method} {response.url} "
+        f"{response.status_code} {elapsed_ms:.0f} ms",
+        file=sys.stderr,
+    )
+
+
+def make_session(
+    pool_size: int = DEFAULT_POOL_SIZE,
+    timeout: Tuple[float, float] = DEFAULT_TIMEOUT,
+    retries: int = DEFAULT_RETRIES,
+    retry_methods: Optional[Iterable[str]] = None,
+    headers: Optional[Dict[str, str]] = None,
+    hooks: Optional[List[Callable]] = None,
+) -> TimeoutSession:
+    """
+    Build a pooled session with default timeouts and retries.
+
+    Only idempotent methods are retried by default; pass retry_methods
+    (e.g. {"GET", "POST"}) for APIs where repeating a POST is safe.
+    """
+    retry = Retry(
+        total=retries,
+        backoff_factor=BACKOFF_FACTOR,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset(retry_methods) if retry_methods else Retry.DEFAULT_ALLOWED_METHODS,
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+
+    session = TimeoutSession(timeout)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    if headers:
+        session.headers.update(headers)
+    if os.environ.get("HTTP_TIMING"):
+        session.hooks["response"].append(log_timing)
+    for hook in hooks or []:
+        session.hooks["response"].append(hook)
+    return session
+
+
+class SidecarValidators:
+    """
+    Default validator store for download(): JSON in <path>.meta.
+
+    One record per file; "partial" marks validators of a .part file that
+    is still being downloaded, as opposed to those of the finished file.
+    """
+
+    def __init__(self, path):
+        path = Path(path)
+        self.meta_path = path.with_name(path.name + ".meta")
+
+    def _read(self) -> Dict:
+        try:
+            return json.loads(self.meta_path.read_text())
+        except (OSError, ValueError):
+            return {}
+
+    def load_validators(self, url: str, partial: bool) -> Dict[str, str]:
+        meta = self._read()
+        if meta.get("url") != url or bool(meta.get("partial")) != partial:
+            return {}
+        return {k: meta[k] for k in ("etag", "last_modified") if meta.get(k)}
+
+    def save_validators(self, url: str, headers, partial: bool) -> None:
+        self.meta_path.write_text(json.dumps({
+            "url": url,
+            "etag": headers.get("ETag"),
+            "last_modified": headers.get("Last-Modified"),
+            "partial": partial,
+        }))
+
+    def complete_validators(self, url: str) -> None:
+        meta = self._read()
+        if meta.get("url") == url:
+            meta["partial"] = False
+            self.meta_path.write_text(json.dumps(meta))
+
+
+def _range_start(response: requests.Response) -> Optional[int]:
+    """First byte position of a 206 response, from Content-Range."""
+    unit, _, spec = response.headers.get("Content-Range", "").partition(" ")
+    try:
+        return int(spec.split("-", 1)[0]) if unit == "bytes" else None
+    except ValueError:
+        return None
+
+
+def _same_size(session: requests.Session, url: str, path: Path) -> bool:
+    """True if HEAD reports the same Content-Length as the local file."""
+    response = session.head(url, allow_redirects=True)
+    length = response.headers.get("Content-Length")
+    return response.status_code == 200 and length is not None and int(length) == path.stat().st_size
+
+
+def download(
+    session: requests.Session,
+    url: str,
+    path,
+    store=None,
+    resume: bool = False,
+    on_chunk: Optional[Callable[[bytes], None]] = None,
+    existing=None,
+    conditional: bool = True,
+) -> str:
+    """
+    Download url into path with a conditional GET.
+
+    ETag and Last-Modified of the previous download (from store, by default
+    a SidecarValidators for path) are sent back as If-None-Match /
+    If-Modified-Since. A file without validators is checked against its
+    own mtime, but only after a HEAD shows the remote size matches, so a
+    truncated copy is never taken for up to date. `existing` is the current
+    copy if it lives under another name than path. conditional=False
+    forces a full fetch (e.g. the caller already found the copy stale).
+
+    The body is streamed into <path>.part and renamed into place. With
+    resume=True a leftover .part is continued with Range/If-Range, but only
+    if its validators are known and the server answers from the right
+    offset; otherwise it is fetched from the start. A failed download
+    removes the .part unless it can be resumed later.
+
+    on_chunk, if given, sees the whole body in order, including the bytes
+    already in a resumed .part.
+
+    Returns "not_modified", "downloaded" or "resumed"; raises
+    requests.RequestException on errors.
+    """
+    path = Path(path)
+    part = path.with_name(path.name + ".part")
+    store = store or SidecarValidators(path)
+    existing = Path(existing) if existing else (path if path.exists() else None)
+
+    headers = {}
+    if existing and conditional:
+        validators = store.load_validators(url, partial=False)
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("last_modified"):
+            headers["If-Modified-Since"] = validators["last_modified"]
+        if not validators and _same_size(session, url, existing):
+            headers["If-Modified-Since"] = formatdate(existing.stat().st_mtime, usegmt=True)
+
+    offset = part.stat().st_size if resume and part.exists() else 0
+    if offset:
+        validators = store.load_validators(url, partial=True)
+        validator = validators.get("etag") or validators.get("last_modified")
+        if validator:
+            headers["Range"] = f"bytes={offset}-"
+            headers["If-Range"] = validator
+        else:
+            offset = 0
+
+    # A .part we are resuming from stays for the next attempt
+    keep_part = bool(offset)
+    try:
+        with session.get(url, headers=headers, stream=True) as response:
+            if response.status_code == 304:
+                return "not_modified"
+            if offset and (response.status_code == 416 or (
+                    response.status_code == 206 and _range_start(response) != offset)):
+                # .part does not match the remote file, start over
+                response.close()
+                part.unlink()
+                return download(session, url, path, store, resume, on_chunk, existing, conditional)
+            response.raise_for_status()
+
+            resumed = response.status_code == 206
+            if resumed:
+                keep_part = True
+                if on_chunk:
+                    with open(part, "rb") as file:
+                        for chunk in iter(lambda: file.read(CHUNK_SIZE), b""):
+                            on_chunk(chunk)
+            else:
+                store.save_validators(url, response.headers, partial=True)
+                keep_part = resume and bool(
+                    response.headers.get("ETag") or response.headers.get("Last-Modified"))
+
+            with open(part, "ab" if resumed else "wb") as file:
+                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                    if on_chunk:
+                        on_chunk(chunk)
+                    file.write(chunk)
+    except BaseException:
+        if not keep_part and part.exists():
+            part.unlink()
+        raise
+
+    os.replace(part, path)
+    store.complete_validators(url)
+    return "resumed" if resumed else "downloaded"
@@ -6,11 +6,13 @@ import os
 import requests
 import gzip
 import ipaddress
-from datetime import datetime
 from pathlib import Path
 import argparse
 import concurrent.futures
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "common"))
+import http_client
+
 CACHE_DIR = Path.home() / "tmp" / "inetnum"
 
 RIR_DATABASES = {
@@ -36,6 +38,9 @@ RIR_DATABASES = {
     }
 }
 
+# One pooled session for all RIR downloads (they run in parallel with 'all')
+session = http_client.make_session(pool_size=len(RIR_DATABASES))
+
 def ensure_cache_dir():
     CACHE_DIR.mkdir(parents=True, exist_ok=True)
 
@@ -44,35 +49,17 @@ def download_if_needed(rir):
     cache_file = CACHE_DIR / RIR_DATABASES[rir]['file']
     url = RIR_DATABASES[rir]['url']
 
-    if cache_file.exists():
-        print(f"Checking if local file {cache_file} is up to date...", file=sys.stderr)
-        try:
-            head = requests.head(url)
-            remote_size = int(head.headers.get('Content-Length', 0))
-            remote_modified = head.headers.get('Last-Modified')
-
-            if remote_modified:
-                remote_modified = datetime.strptime(remote_modified, "%a, %d %b %Y %H:%M:%S GMT")
-                local_modified = datetime.fromtimestamp(cache_file.stat().st_mtime)
-
-                if remote_size == cache_file.stat().st_size and remote_modified <= local_modified:
-                    print(f"Local file for {rir} is up to date. Using cached version.", file=sys.stderr)
-                    return
-        except requests.RequestException as e:
-            print(f"Error checking remote file: {e}", file=sys.stderr)
-            print("Using cached version.", file=sys.stderr)
-            return
-
-    print(f"Downloading fresh copy from {url}...", file=sys.stderr)
+    print(f"Fetching {url} (conditional GET against {cache_file})...", file=sys.stderr)
     try:
-        response = requests.get(url, stream=True)
-        response.raise_for_status()
-        with open(cache_file, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
-        print(f"Download complete for {rir}.", file=sys.stderr)
+        if http_client.download(session, url, cache_file) != 'not_modified':
+            print(f"Download complete for {rir}.", file=sys.stderr)
+        else:
+            print(f"Local file for {rir} is up to date. Using cached version.", file=sys.stderr)
     except requests.RequestException as e:
-        raise Exception(f"Failed to download file for {rir}: {e}")
+        if not cache_file.exists():
+            raise Exception(f"Failed to download file for {rir}: {e}")
+        print(f"Error checking remote file: {e}", file=sys.stderr)
+        print("Using cached version.", file=sys.stderr)
 
 def process_file(rir, search_term):
     search_term_lower = search_term.lower()
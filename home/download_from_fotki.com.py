@@ -2,95 +2,440 @@
 # SPDX-License-Identifier: GPL-2.0-or-later OR MIT
 
 import argparse
+import concurrent.futures
 from datetime import datetime
+from email.utils import parsedate_to_datetime
+import hashlib
 from pathlib import Path
 import os
+import sqlite3
+import struct
+import sys
+import threading
+from urllib.parse import urljoin
 import requests
-from dateutil.parser import parse
-from PIL import Image
-from PIL.ExifTags import TAGS
 import xml.etree.ElementTree as ET
 
-def get_exif(filename):
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "common"))
+import http_client
+
+MAX_WORKERS = 8
+CHUNK_SIZE = 64 * 1024
+# APP1 segment is at most 64 KiB and sits right after SOI (maybe after APP0)
+EXIF_PREFIX = 128 * 1024
+DATE_FORMAT = '%d-%m-%Y'
+
+# Archive index in the output root: what was fetched from where, by content hash
+MANIFEST_NAME = '.fotki_manifest.sqlite'
+
+MEDIA_CONTENT = '{http://search.yahoo.com/mrss/}content'
+ATOM_LINK = '{http://www.w3.org/2005/Atom}link'
+
+TAG_EXIF_IFD = 0x8769
+TAG_DATETIME_ORIGINAL = 0x9003
+
+class Manifest:
+    """SQLite index of archived files keyed by source URL and content hash.
+
+    Paths are stored relative to the output root. HTTP validators (ETag,
+    Last-Modified) are kept per URL, not on the file, because hardlinked
+    duplicates share one inode; the manifest is the validator store passed
+    to http_client.download(). One connection is shared by the download
+    threads behind a lock, which also guards the set of URLs in flight.
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.lock = threading.Lock()
+        self.in_flight = set()
+        self.db = sqlite3.connect(self.root / MANIFEST_NAME, check_same_thread=False)
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS files ('
+            ' url TEXT PRIMARY KEY, sha256 TEXT NOT NULL, path TEXT NOT NULL,'
+            ' size INTEGER NOT NULL, added TEXT NOT NULL)'
+        )
+        self.db.execute('CREATE INDEX IF NOT EXISTS files_sha256 ON files (sha256)')
+        # partial=1: validators of a .part file still being downloaded
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS validators ('
+            ' url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT,'
+            ' partial INTEGER NOT NULL)'
+        )
+        self.db.commit()
+
+    def claim(self, url):
+        """Reserve url for this thread.
+
+        Returns None on success, or 'known' / 'in-flight' if the url is
+        already archived (and the file is still there) or being fetched.
+        """
+        with self.lock:
+            if url in self.in_flight:
+                return 'in-flight'
+            row = self.db.execute('SELECT path FROM files WHERE url = ?', (url,)).fetchone()
+            if row and (self.root / row[0]).exists():
+                return 'known'
+            self.in_flight.add(url)
+            return None
+
+    def release(self, url):
+        with self.lock:
+            self.in_flight.discard(url)
+
+    def load_validators(self, url, partial):
+        """{'etag': ..., 'last_modified': ...} stored for url, or {}."""
+        with self.lock:
+            row = self.db.execute(
+                'SELECT etag, last_modified FROM validators WHERE url = ? AND partial = ?',
+                (url, int(partial)),
+            ).fetchone()
+        if not row:
+            return {}
+        return {k: v for k, v in zip(('etag', 'last_modified'), row) if v}
+
+    def save_validators(self, url, headers, partial):
+        with self.lock:
+            self.db.execute(
+                'INSERT OR REPLACE INTO validators (url, etag, last_modified, partial)'
+                ' VALUES (?, ?, ?, ?)',
+                (url, headers.get('ETag'), headers.get('Last-Modified'), int(partial)),
+            )
+            self.db.commit()
+
+    def complete_validators(self, url):
+        """The .part for url became the archived file."""
+        with self.lock:
+            self.db.execute('UPDATE validators SET partial = 0 WHERE url = ?', (url,))
+            self.db.commit()
+
+    def add(self, url, sha256, path):
+        """Record url -> path, replacing path with a hardlink to an archived copy
+        of the same content if there is one.
+
+        Lookup and insert happen under one lock, so two threads finishing
+        identical content at once still end up with one copy on disk.
+        Returns the archived original path if path was linked to it.
+        """
+        path = Path(path)
+        linked = None
+        with self.lock:
+            rows = self.db.execute('SELECT path FROM files WHERE sha256 = ?', (sha256,)).fetchall()
+            original = next((self.root / p for (p,) in rows if (self.root / p).exists()), None)
+            if original and not path.samefile(original):
+                tmp = path.with_name(path.name + '.link')
+                try:
+                    os.link(original, tmp)
+                    os.replace(tmp, path)
+                    linked = original
+                except OSError as e:
+                    # No hardlinks on this filesystem (FAT/exFAT): keep the copy
+                    print(f"Cannot hardlink {path} to {original}, keeping a copy: {e}")
+            self.db.execute(
+                'INSERT OR REPLACE INTO files (url, sha256, path, size, added) VALUES (?, ?, ?, ?, ?)',
+                (url, sha256, str(path.relative_to(self.root)), path.stat().st_size,
+                 datetime.now().isoformat(timespec='seconds')),
+            )
+            self.db.commit()
+        return linked
+
+    def close(self):
+        self.db.close()
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest
+
+def _read_ifd(tiff, offset, endian):
+    """Return {tag: (type, count, value_or_offset_bytes)} for one IFD."""
+    count, = struct.unpack_from(endian + 'H', tiff, offset)
+    entries = {}
+    for i in range(count):
+        tag, typ, n, value = struct.unpack_from(endian + 'HHI4s', tiff, offset + 2 + i * 12)
+        entries[tag] = (typ, n, value)
+    return entries
+
+def get_date_from_exif(data):
+    """Parse DateTimeOriginal from the APP1/EXIF header of JPEG bytes.
+
+    Only the segment headers are walked, the image itself is not decoded.
+    Returns a date or None.
+    """
     try:
-        image = Image.open(filename)
-        image.verify()
-        return image._getexif()
-    except (IOError, AttributeError):
-        return None
+        if data[:2] != b'\xff\xd8':
+            return None
+        pos = 2
+        while pos + 4 <= len(data) and data[pos] == 0xFF:
+            marker = data[pos + 1]
+            if marker in (0xD9, 0xDA):  # EOI / start of scan, no EXIF ahead
+                return None
+            length, = struct.unpack_from('>H', data, pos + 2)
+            segment = data[pos + 4:pos + 2 + length]
+            if marker == 0xE1 and segment[:6] == b'Exif\0\0':
+                break
+            pos += 2 + length
+        else:
+            return None
 
-def get_labeled_exif(exif):
-    if exif is not None:
-        labeled = {}
-        for (key, val) in exif.items():
-            if key in TAGS:
-                labeled[TAGS[key]] = val
-        return labeled
-    else:
-        return {}
-
-def get_date_from_exif(exif):
-    if exif is not None and "DateTimeOriginal" in exif:
-        try:
-            return parse(exif["DateTimeOriginal"]).date()
-        except ValueError:
+        tiff = segment[6:]
+        endian = {b'II': '<', b'MM': '>'}[tiff[:2]]
+        ifd0, = struct.unpack_from(endian + 'I', tiff, 4)
+        exif_ifd = _read_ifd(tiff, ifd0, endian).get(TAG_EXIF_IFD)
+        if exif_ifd is None:
+            return None
+        exif_offset, = struct.unpack(endian + 'I', exif_ifd[2])
+        entry = _read_ifd(tiff, exif_offset, endian).get(TAG_DATETIME_ORIGINAL)
+        if entry is None:
             return None
-    else:
+        _, n, value = entry
+        if n > 4:
+            offset, = struct.unpack(endian + 'I', value)
+            value = tiff[offset:offset + n]
+        return datetime.strptime(value[:10].decode('ascii'), '%Y:%m:%d').date()
+    except (struct.error, KeyError, IndexError, ValueError, UnicodeDecodeError):
+        return None
+
+def find_existing(directory, filename):
+    """Existing file for filename, possibly already renamed with an EXIF date prefix."""
+    path = Path(directory) / filename
+    if path.exists():
+        return path
+    return next(Path(directory).glob(f'??-??-????_{filename}'), None)
+
+def download_image(session, manifest, url, directory, filename):
+    """Download url into directory with http_client.download().
+
+    The manifest is the validator store (ETag/Last-Modified per URL), so
+    unchanged files are skipped and a leftover .part is resumed safely.
+    An existing file without validators is compared by size with HEAD.
+    The EXIF date is parsed from the first bytes of the stream and the
+    content is hashed on the fly, so the file is never read back.
+    Returns (status, exif_date, sha256) where status is 'downloaded',
+    'resumed', 'skipped' or 'failed'; sha256 is None unless downloaded.
+    """
+    path = Path(directory) / filename
+    existing = find_existing(directory, filename)
+    head = bytearray()
+    digest = hashlib.sha256()
+
+    def on_chunk(chunk):
+        if len(head) < EXIF_PREFIX:
+            head.extend(chunk[:EXIF_PREFIX - len(head)])
+        digest.update(chunk)
+
+    try:
+        conditional = True
+        if existing and not manifest.load_validators(url, partial=False):
+            # No validator: compare sizes without fetching the body
+            response = session.head(url, allow_redirects=True)
+            length = response.headers.get('Content-Length')
+            if response.status_code == 200 and length and int(length) == existing.stat().st_size:
+                manifest.save_validators(url, response.headers, partial=False)
+                return 'skipped', None, None
+            # Size differs (e.g. truncated by an older run): fetch it in full
+            conditional = False
+
+        status = http_client.download(session, url, path, store=manifest, resume=True,
+                                      on_chunk=on_chunk, existing=existing,
+                                      conditional=conditional)
+    except requests.RequestException as e:
+        print(f"Failed to download {filename} from {url}: {e}")
+        return 'failed', None, None
+
+    if status == 'not_modified':
+        return 'skipped', None, None
+    if existing and existing != path:
+        # Changed upstream: drop the old EXIF-prefixed copy, the rename is redone below
+        existing.unlink()
+    print(f"Downloaded {filename} to {directory}")
+    return status, get_date_from_exif(bytes(head)), digest.hexdigest()
+
+def process_image(session, manifest, url, date):
+    # Also stops the same url from overlapping feeds being fetched twice at once
+    claimed = manifest.claim(url)
+    if claimed:
+        return claimed
+    try:
+        return _process_claimed(session, manifest, url, date)
+    finally:
+        manifest.release(url)
+
+def _process_claimed(session, manifest, url, date):
+    directory = manifest.root / date
+    directory.mkdir(exist_ok=True)
+    filename = os.path.basename(url)
+    status, exif_date, sha256 = download_image(session, manifest, url, directory, filename)
+    if status == 'failed':
+        return status
+    if status == 'skipped':
+        # Archived before the manifest existed: index it once
+        path = find_existing(directory, filename)
+        manifest.add(url, file_sha256(path).hexdigest(), path)
+        return status
+
+    # Photos whose EXIF date differs from the feed date get it as a name prefix
+    path = directory / filename
+    if exif_date and exif_date.strftime(DATE_FORMAT) != date:
+        new_filename = f"{exif_date.strftime(DATE_FORMAT)}_{filename}"
+        os.rename(path, directory / new_filename)
+        path = directory / new_filename
+        print(f"Renamed {filename} to {new_filename}: EXIF date {exif_date.strftime(DATE_FORMAT)} differs from {date}")
+
+    # Same content already archived under another name: keep one copy on disk
+    original = manifest.add(url, sha256, path)
+    if original:
+        print(f"Hardlinked {path} to {original}")
+        return 'linked'
+    return status
+
+def parse_title_date(text):
+    try:
+        return datetime.strptime((text or '').strip()[:10], '%Y-%m-%d').date()
+    except ValueError:
         return None
 
-def download_image(url, directory, filename):
-    response = requests.get(url)
-    if response.status_code == 200:
-        with open(os.path.join(directory, filename), 'wb') as file:
-            file.write(response.content)
-            print(f"Downloaded {filename} to {directory}")
-    else:
-        print(f"Failed to download {filename} from {url}")
+def item_date(item, default):
+    """Date of an RSS item: its title prefix, then pubDate, then the channel date."""
+    date = parse_title_date(item.findtext('title'))
+    if date is None and item.findtext('pubDate'):
+        try:
+            date = parsedate_to_datetime(item.findtext('pubDate')).date()
+        except (TypeError, ValueError):
+            pass
+    return date or default
+
+class ResponseReader:
+    """Minimal file object over response.iter_content() for iterparse.
+
+    Reading response.raw directly would let urllib3 errors (dropped
+    connection, read timeout) escape; iter_content turns them into
+    requests exceptions and also undoes Content-Encoding.
+    """
+
+    def __init__(self, response):
+        self.chunks = response.iter_content(chunk_size=CHUNK_SIZE)
+        self.buffer = b''
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                break
+            self.buffer += chunk
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+def iter_feed(session, url):
+    """Yield (image_url, date) from an RSS feed and its rel="next" pages.
+
+    The response is parsed incrementally with iterparse and every item is
+    dropped once yielded, so memory does not depend on feed size. Pages
+    already fetched are remembered, so a next link pointing back stops the
+    walk instead of looping.
+    """
+    visited = set()
+    while url:
+        if url in visited:
+            print(f"Feed page {url} was already read, stopping pagination")
+            return
+        visited.add(url)
+        next_url = None
+        channel_date = None
+        with session.get(url, stream=True) as response:
+            response.raise_for_status()
+            # Stack of open elements, to know the parent of a finished item
+            stack = []
+            for event, elem in ET.iterparse(ResponseReader(response), events=('start', 'end')):
+                if event == 'start':
+                    stack.append(elem)
+                    continue
+                stack.pop()
+                if elem.tag == 'title' and channel_date is None and 'item' not in (e.tag for e in stack):
+                    channel_date = parse_title_date(elem.text)
+                elif elem.tag == ATOM_LINK and elem.get('rel') == 'next':
+                    next_url = urljoin(url, elem.get('href'))
+                elif elem.tag == 'item':
+                    date = item_date(elem, channel_date)
+                    for media in elem.iter(MEDIA_CONTENT):
+                        if media.get('url') and date:
+                            yield media.get('url'), date.strftime(DATE_FORMAT)
+                        elif media.get('url'):
+                            print(f"No date for {media.get('url')}, skipped")
+                    if stack:
+                        stack[-1].remove(elem)
+        url = next_url
+
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be a positive integer, got {value}")
+    return number
+
+def read_feeds(urls, from_file=None):
+    feeds = list(urls)
+    if from_file:
+        with open(from_file, 'r') as file:
+            feeds.extend(line.strip() for line in file)
+    return [f for f in dict.fromkeys(feeds) if f and not f.startswith('#')]
 
 def main():
     parser = argparse.ArgumentParser(description='RSS Image Downloader')
-    parser.add_argument('rss_url', help='URL of the RSS feed')
+    parser.add_argument('rss_url', nargs='*', help='URL of the RSS feed')
+    parser.add_argument('--feeds', help='File with RSS feed URLs, one per line')
+    parser.add_argument('--workers', type=positive_int, default=MAX_WORKERS,
+                        help=f'Parallel downloads (default {MAX_WORKERS})')
+    parser.add_argument('--output', default='.',
+                        help=f'Archive root, holds date directories and {MANIFEST_NAME}')
     args = parser.parse_args()
 
-    response = requests.get(args.rss_url)
-    data = response.text
+    feeds = read_feeds(args.rss_url, args.feeds)
+    if not feeds:
+        parser.error('no RSS feeds given')
+
+    session = http_client.make_session(pool_size=args.workers)
+    Path(args.output).mkdir(parents=True, exist_ok=True)
+    manifest = Manifest(args.output)
+    stats = {}
+    stats_lock = threading.Lock()
+    # Items go to the pool while the feed is still being parsed; the
+    # semaphore keeps the parser only a little ahead of the downloads
+    pending = threading.Semaphore(args.workers * 4)
+
+    def done(future):
+        pending.release()
+        if future.exception():
+            print(f"Error processing image: {future.exception()!r}")
+            status = 'failed'
+        else:
+            status = future.result()
+        with stats_lock:
+            stats[status] = stats.get(status, 0) + 1
 
     try:
-        root = ET.fromstring(data)
-        image_urls = [item.attrib['url'] for item in root.findall('.//media:content', namespaces={'media': 'http://search.yahoo.com/mrss/'})]
-        titles = [root.find('.//title').text[:10]]
-    except ET.ParseError:
-        print("Error parsing the RSS feed.")
-        return
-
-    if not image_urls:
-        print("No image URLs found in the RSS feed.")
-        return
-
-    if not titles:
-        print("No titles found in the RSS feed.")
-        return
-
-    print(f"Found {len(image_urls)} image URLs and {len(titles)} titles in the RSS feed.")
-
-    for title, url in zip(titles * len(image_urls), image_urls):
-        date = datetime.strptime(title, '%Y-%m-%d').strftime('%d-%m-%Y')
-        directory = Path(date)
-        directory.mkdir(exist_ok=True)
-        filename = os.path.basename(url)
-        download_image(url, directory, filename)
-
-        # Check EXIF date
-        filepath = directory / filename
-        exif = get_exif(filepath)
-        labeled_exif = get_labeled_exif(exif)
-        exif_date = get_date_from_exif(labeled_exif)
-        if exif_date and exif_date != date:
-            new_filename = f"{date}_{filename}"
-            os.rename(filepath, directory / new_filename)
-            print(f"Updated date for {filename} from {exif_date} to {date}")
-
-    print("All images processed.")
+        with concurrent.futures.ThreadPoolExecutor(max_workers=args.workers) as executor:
+            for feed in feeds:
+                found = 0
+                try:
+                    for url, date in iter_feed(session, feed):
+                        pending.acquire()
+                        executor.submit(process_image, session, manifest, url, date).add_done_callback(done)
+                        found += 1
+                except (requests.RequestException, ET.ParseError) as e:
+                    # Report and go on with the next feed; queued items still download
+                    print(f"Error reading the RSS feed {feed} after {found} items: {e}")
+                    continue
+                if not found:
+                    print(f"No image URLs found in the RSS feed {feed}.")
+                else:
+                    print(f"Found {found} image URLs in the RSS feed {feed}.")
+    finally:
+        manifest.close()
+
+    print("All images processed: " + ", ".join(f"{k}={v}" for k, v in sorted(stats.items())))
 
 if __name__ == "__main__":
     main()
@@ -1,50 +1,432 @@
 #!/usr/bin/env python3
 # SPDX-License-Identifier: GPL-2.0-or-later OR MIT
 
-# You need to set ZONE_ID and API_TOKEN in /etc/cloudflare/credentials file
-# ZONE_ID=your_zone_id
+# You need to set API_TOKEN and at least one zone in /etc/cloudflare/credentials file
 # API_TOKEN=your_api_token
+# ZONE_ID=your_zone_id
+#
+# Для нескольких зон строки ZONE_ID можно повторять, а зоны можно задавать
+# по имени — ID найдутся одним запросом к API:
+# ZONE_ID=first_zone_id
+# ZONE_ID=second_zone_id
+# ZONE=example.org
+# ZONE=example.net
+#
+# Usage:
+#   cf_purge_zone.py                                   # purge everything во всех зонах из файла
+#   cf_purge_zone.py --zone example.org                # только указанная зона (имя или ID)
+#   cf_purge_zone.py --all-zones                       # все зоны, доступные токену
+#   cf_purge_zone.py --files https://example.com/app.css https://example.com/app.js
+#   cf_purge_zone.py --prefixes example.com/static/ example.com/img/
+#   cf_purge_zone.py --tags release-42
+#   cf_purge_zone.py --hosts static.example.com
+#   cf_purge_zone.py --files --from-file changed_urls.txt
+#   git diff --name-only HEAD~1 | sed 's|^|https://example.com/|' | cf_purge_zone.py --files -
+#   cf_purge_zone.py --zone example.com --watch /var/www/example.com --base-url https://example.com/
+#
+# Цели режут на пачки по лимиту Cloudflare (--batch-size), пачки отправляются
+# параллельно через одну сессию, на 429/5xx — повтор с экспоненциальной задержкой.
+# Зоны обрабатываются параллельно (не более --zone-workers одновременно),
+# в конце печатается сводка со статусом и временем по каждой зоне.
+#
+# В режиме --watch скрипт висит на inotifywait (пакет inotify-tools), копит
+# изменённые файлы, пока идёт деплой, и через --debounce секунд тишины
+# (но не позже --max-wait) отправляет их URL одним пакетным purge по files.
+
+import argparse
+import concurrent.futures
+import os
+import queue
+import re
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+from urllib.parse import quote
 
 import requests
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "common"))
+import http_client
+
+CREDENTIALS_FILE = '/etc/cloudflare/credentials'
+API_URL = "https://api.cloudflare.com/client/v4"
+
+# Лимит элементов в одном запросе purge_cache для Free/Pro/Business.
+# На Enterprise для files можно поднять до 500 через --batch-size.
+BATCH_SIZE = 30
+MAX_WORKERS = 4
+ZONE_WORKERS = 8
+
+PURGE_MODES = ('files', 'prefixes', 'tags', 'hosts')
+
+# Ключи, которые в файле credentials могут повторяться
+MULTI_KEYS = ('ZONE_ID', 'ZONE')
+
+ZONE_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+
+# Режим --watch
+DEBOUNCE = 5
+MAX_WAIT = 60
+WATCH_EVENTS = 'close_write,moved_to,moved_from,delete,attrib'
+INDEX_FILES = ('index.html', 'index.htm')
+IGNORE_SUFFIXES = ('.swp', '.swx', '.tmp', '~')
+
+
 # Функция для чтения данных из файла
 def read_credentials(filepath):
-    credentials = {}
+    credentials = {key: [] for key in MULTI_KEYS}
     with open(filepath, 'r') as file:
         for line in file:
-            key, value = line.strip().split('=')
-            credentials[key] = value
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            key, value = line.split('=', 1)
+            key, value = key.strip(), value.strip()
+            if key in MULTI_KEYS:
+                credentials[key].extend(v.strip() for v in value.split(',') if v.strip())
+            else:
+                credentials[key] = value
     return credentials
 
-# Чтение данных из файла /etc/cloudflare/credentials
-credentials = read_credentials('/etc/cloudflare/credentials')
 
-zone_id = credentials.get("ZONE_ID")
-api_token = credentials.get("API_TOKEN")
+def read_targets(values, from_file=None):
+    """Собрать цели из аргументов, файла и stdin ('-'), без дублей, с сохранением порядка."""
+    lines = []
+    for value in values:
+        if value == '-':
+            lines.extend(sys.stdin)
+        else:
+            lines.append(value)
+    if from_file:
+        with open(from_file, 'r') as file:
+            lines.extend(file)
+
+    targets = []
+    seen = set()
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#') or line in seen:
+            continue
+        seen.add(line)
+        targets.append(line)
+    return targets
+
+
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be a positive integer, got {value}")
+    return number
+
+
+def chunked(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def make_session(api_token, pool_size=MAX_WORKERS):
+    # purge_cache идемпотентен, поэтому POST тоже можно повторять
+    return http_client.make_session(
+        pool_size=pool_size,
+        retry_methods={'GET', 'POST'},
+        headers={
+            "Authorization": f"Bearer {api_token}",
+            "Content-Type": "application/json"
+        },
+    )
+
+
+def api_request(session, method, path, **kwargs):
+    """Запрос к API (повторы на 429/5xx делает сессия). Возвращает (response или None, ошибка)."""
+    try:
+        response = session.request(method, f"{API_URL}{path}", **kwargs)
+    except requests.RequestException as e:
+        return None, str(e)
+    if response.status_code != 200:
+        return None, f"{response.status_code} - {response.text}"
+    return response, None
+
+
+def post_purge(session, zone_id, data):
+    """POST в purge_cache. Возвращает (ok, сообщение)."""
+    response, error = api_request(session, 'POST', f"/zones/{zone_id}/purge_cache", json=data)
+    if response is None:
+        return False, error
+    return True, "ok"
+
+
+def list_zones(session):
+    """Все зоны, доступные токену: {имя: id}."""
+    zones = {}
+    page = 1
+    while True:
+        response, error = api_request(session, 'GET', '/zones',
+                                      params={'page': page, 'per_page': 50})
+        if response is None:
+            raise RuntimeError(f"не удалось получить список зон: {error}")
+        body = response.json()
+        for zone in body['result']:
+            zones[zone['name']] = zone['id']
+        if page >= body['result_info']['total_pages']:
+            return zones
+        page += 1
+
+
+def resolve_zones(session, credentials, selected=None, all_zones=False):
+    """Собрать список (имя, id) для purge.
+
+    Зоны берутся из --zone (selected), иначе из файла credentials.
+    Имена превращаются в ID одним проходом по списку зон аккаунта, и только
+    если есть что искать.
+    """
+    if all_zones:
+        return sorted(list_zones(session).items())
+
+    refs = selected or credentials['ZONE_ID'] + credentials['ZONE']
+    names = [ref for ref in refs if not ZONE_ID_RE.match(ref)]
+    known = list_zones(session) if names else {}
+
+    zones = []
+    seen = set()
+    for ref in refs:
+        if ZONE_ID_RE.match(ref):
+            zone = (ref, ref)
+        elif ref in known:
+            zone = (ref, known[ref])
+        else:
+            raise RuntimeError(f"зона {ref} не найдена")
+        if zone[1] not in seen:
+            seen.add(zone[1])
+            zones.append(zone)
+    return zones
+
+
+def purge(session, zone_id, mode=None, targets=None, batch_size=BATCH_SIZE, workers=MAX_WORKERS):
+    """Выполнить purge для зоны. Без mode — purge everything. Возвращает (ok, сообщение)."""
+    if mode is None:
+        return post_purge(session, zone_id, {"purge_everything": True})
+
+    batches = list(chunked(targets, batch_size))
+    errors = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(post_purge, session, zone_id, {mode: batch})
+            for batch in batches
+        ]
+        for future in concurrent.futures.as_completed(futures):
+            ok, message = future.result()
+            if not ok:
+                errors.append(message)
+
+    if errors:
+        return False, f"{len(errors)} из {len(batches)} запросов с ошибкой: {errors[0]}"
+    return True, f"{len(targets)} {mode}, {len(batches)} запросов"
+
+
+def _purge_zone(session, zone_id, mode, targets, batch_size, workers):
+    started = time.monotonic()
+    try:
+        ok, message = purge(session, zone_id, mode, targets, batch_size, workers)
+    except Exception as e:
+        ok, message = False, repr(e)
+    return ok, message, time.monotonic() - started
+
+
+def purge_zones(session, zones, mode=None, targets=None, batch_size=BATCH_SIZE,
+                workers=MAX_WORKERS, zone_workers=ZONE_WORKERS):
+    """Purge нескольких зон параллельно. Печатает сводку, возвращает число ошибок."""
+    results = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=zone_workers) as executor:
+        future_to_zone = {
+            executor.submit(_purge_zone, session, zone_id, mode, targets, batch_size, workers): name
+            for name, zone_id in zones
+        }
+        for future in concurrent.futures.as_completed(future_to_zone):
+            results[future_to_zone[future]] = future.result()
+
+    failed = 0
+    width = max(len(name) for name, _ in zones)
+    print(f"\n{'zone':<{width}}  status  time     details")
+    for name, _ in zones:
+        ok, message, elapsed = results[name]
+        if not ok:
+            failed += 1
+        status = "OK" if ok else "ERROR"
+        print(f"{name:<{width}}  {status:<6}  {elapsed:6.2f}s  {message}")
+    print(f"\nЗон: {len(zones)}, успешно: {len(zones) - failed}, с ошибкой: {failed}.")
+    return failed
+
+
+def path_to_urls(path, docroot, base_url):
+    """URL для изменённого файла; для index.html ещё и URL каталога.
+
+    Каталоги (путь с '/' на конце) превращаются в URL со слешем на конце.
+    """
+    is_dir = path.endswith('/')
+    rel = os.path.relpath(path, docroot)
+    outside = rel == '..' or rel.startswith('..' + os.sep)
+    if outside or path.endswith(IGNORE_SUFFIXES):
+        return []
+    base = base_url.rstrip('/')
+    if rel == '.':
+        return [f"{base}/"]
+    rel = rel.replace(os.sep, '/')
+    if is_dir:
+        return [f"{base}/{quote(rel)}/"]
+    urls = [f"{base}/{quote(rel)}"]
+    directory, name = rel.rpartition('/')[::2]
+    if name in INDEX_FILES:
+        urls.append(f"{base}/{quote(directory)}/" if directory else f"{base}/")
+    return urls
+
+
+def _read_events(process, events):
+    # Строка: "EVENT[,EVENT...] path", путь может содержать пробелы
+    for line in process.stdout:
+        flags, _, path = line.rstrip('\n').partition(' ')
+        if 'ISDIR' in flags.split(','):
+            path = path.rstrip('/') + '/'
+        events.put(path)
+    events.put(None)
+
+
+def watch(session, zones, docroot, base_url, debounce=DEBOUNCE, max_wait=MAX_WAIT,
+          batch_size=BATCH_SIZE, workers=MAX_WORKERS, zone_workers=ZONE_WORKERS):
+    """Следить за docroot и отправлять purge по files пачками после затишья."""
+    if not shutil.which('inotifywait'):
+        print("Ошибка: не найден inotifywait, установите inotify-tools.", file=sys.stderr)
+        return 1
+
+    process = subprocess.Popen(
+        ['inotifywait', '-m', '-r', '-q', '-e', WATCH_EVENTS, '--format', '%e %w%f', docroot],
+        stdout=subprocess.PIPE, text=True,
+    )
+    events = queue.Queue()
+    threading.Thread(target=_read_events, args=(process, events), daemon=True).start()
+    print(f"Слежу за {docroot} -> {base_url} (debounce {debounce} с, max {max_wait} с)")
+
+    failed = 0
+    running = True
+    stopped = False
+    try:
+        while running:
+            path = events.get()
+            if path is None:
+                break
+            changed = {path}
+            started = time.monotonic()
+
+            # Копим изменения, пока события идут чаще, чем раз в debounce секунд
+            while True:
+                timeout = min(debounce, max_wait - (time.monotonic() - started))
+                if timeout <= 0:
+                    break
+                try:
+                    path = events.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if path is None:
+                    running = False
+                    break
+                changed.add(path)
+
+            targets = sorted({url for p in changed for url in path_to_urls(p, docroot, base_url)})
+            if not targets:
+                continue
+            print(f"\nИзменено файлов: {len(changed)}, URL для purge: {len(targets)}")
+            failed += purge_zones(session, zones, 'files', targets, batch_size, workers, zone_workers)
+    except KeyboardInterrupt:
+        # inotifywait в той же группе процессов и мог уже умереть от SIGINT
+        stopped = True
+    finally:
+        if process.poll() is None:
+            stopped = True
+            process.terminate()
+
+    if process.wait() != 0 and not stopped:
+        print("Ошибка: inotifywait завершился неожиданно.", file=sys.stderr)
+        return 1
+    return 1 if failed else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cloudflare cache purge")
+    mode_group = parser.add_mutually_exclusive_group()
+    for mode in PURGE_MODES:
+        mode_group.add_argument(f'--{mode}', dest='mode', action='store_const', const=mode,
+                                help=f"Purge by {mode}")
+    parser.add_argument('targets', nargs='*',
+                        help="Targets for the selected mode, '-' reads them from stdin")
+    parser.add_argument('--from-file', help="Read targets from file, one per line")
+    zone_group = parser.add_mutually_exclusive_group()
+    zone_group.add_argument('--zone', action='append',
+                            help="Zone name or ID (repeatable), default: all zones from credentials")
+    zone_group.add_argument('--all-zones', action='store_true',
+                            help="Purge every zone the token has access to")
+    parser.add_argument('--batch-size', type=positive_int, default=BATCH_SIZE,
+                        help=f"Items per API request (default {BATCH_SIZE})")
+    parser.add_argument('--workers', type=positive_int, default=MAX_WORKERS,
+                        help=f"Concurrent API requests per zone (default {MAX_WORKERS})")
+    parser.add_argument('--zone-workers', type=positive_int, default=ZONE_WORKERS,
+                        help=f"Zones purged concurrently (default {ZONE_WORKERS})")
+    parser.add_argument('--watch', metavar='DOCROOT',
+                        help="Watch document root and purge changed files")
+    parser.add_argument('--base-url', help="Public URL of the document root for --watch")
+    parser.add_argument('--debounce', type=float, default=DEBOUNCE,
+                        help=f"Quiet period before purge in --watch mode (default {DEBOUNCE}s)")
+    parser.add_argument('--max-wait', type=float, default=MAX_WAIT,
+                        help=f"Max delay of a purge during a long deploy (default {MAX_WAIT}s)")
+    parser.add_argument('--credentials', default=CREDENTIALS_FILE)
+    args = parser.parse_args()
+
+    if args.watch:
+        if not args.base_url:
+            parser.error("--watch requires --base-url")
+        if args.mode or args.targets or args.from_file:
+            parser.error("--watch cannot be combined with purge targets")
+
+    targets = []
+    if args.mode:
+        targets = read_targets(args.targets, args.from_file)
+        if not targets:
+            print(f"Ошибка: не заданы цели для --{args.mode}.", file=sys.stderr)
+            sys.exit(1)
+    elif args.targets or args.from_file:
+        parser.error("targets require one of --files/--prefixes/--tags/--hosts")
+
+    # Чтение данных из файла /etc/cloudflare/credentials
+    credentials = read_credentials(args.credentials)
+    api_token = credentials.get("API_TOKEN")
+    has_zones = args.zone or args.all_zones or credentials['ZONE_ID'] or credentials['ZONE']
 
-if not zone_id or not api_token:
-    print("Ошибка: не удалось получить ZONE_ID или API_TOKEN из файла.")
-    exit(1)
+    if not api_token or not has_zones:
+        print("Ошибка: не удалось получить ZONE_ID/ZONE или API_TOKEN из файла.")
+        sys.exit(1)
 
-# URL для выполнения purge everything
-url = f"https://api.cloudflare.com/client/v4/zones/{zone_id}/purge_cache"
+    # Одна сессия на все зоны: соединение с API переиспользуется
+    session = make_session(api_token, args.workers * args.zone_workers)
+    try:
+        zones = resolve_zones(session, credentials, args.zone, args.all_zones)
+    except RuntimeError as e:
+        print(f"Ошибка: {e}", file=sys.stderr)
+        sys.exit(1)
+    if not zones:
+        print("Ошибка: нет зон для purge.", file=sys.stderr)
+        sys.exit(1)
 
-# Заголовки для авторизации
-headers = {
-    "Authorization": f"Bearer {api_token}",
-    "Content-Type": "application/json"
-}
+    if args.watch:
+        sys.exit(watch(session, zones, os.path.abspath(args.watch), args.base_url,
+                       args.debounce, args.max_wait, args.batch_size,
+                       args.workers, args.zone_workers))
 
-# Тело запроса
-data = {
-    "purge_everything": True
-}
+    failed = purge_zones(session, zones, args.mode, targets, args.batch_size,
+                         args.workers, args.zone_workers)
+    if failed:
+        sys.exit(1)
 
-# Выполнение запроса
-response = requests.post(url, headers=headers, json=data)
 
-# Проверка результата
-if response.status_code == 200:
-    print("Purge everything выполнен успешно.")
-else:
-    print(f"Ошибка при выполнении purge: {response.status_code} - {response.text}")
+if __name__ == "__main__":
+    main()
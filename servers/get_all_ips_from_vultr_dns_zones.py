@@ -1,20 +1,24 @@
 #!/usr/bin/env python3
 # SPDX-License-Identifier: GPL-2.0-or-later OR MIT
 
-import requests
-import json
+import sys
+from pathlib import Path
 from typing import Set
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "common"))
+import http_client
+
 def get_dns_records() -> Set[str]:
     API_KEY = 'YOUR_VULTR_API_KEY'
     
-    headers = {
+    session = http_client.make_session(headers={
         'Authorization': f'Bearer {API_KEY}',
         'Content-Type': 'application/json'
-    }
+    })
 
     domains_url = 'https://api.vultr.com/v2/domains'
-    domains_response = requests.get(domains_url, headers=headers)
+    domains_response = session.get(domains_url)
+    domains_response.raise_for_status()
     domains = domains_response.json()['domains']
 
     ip_addresses = set()
@@ -22,7 +26,8 @@ def get_dns_records() -> Set[str]:
     for domain in domains:
         domain_name = domain['domain']
         records_url = f'https://api.vultr.com/v2/domains/{domain_name}/records'
-        records_response = requests.get(records_url, headers=headers)
+        records_response = session.get(records_url)
+        records_response.raise_for_status()
         records = records_response.json()['records']
         for record in records:
             if record['type'] == 'A':
@@ -27,8 +27,10 @@ Notes:
 - Matches monitors by name (common sane denominator).
 - Skips existing monitors unless --update is provided.
 - DNS monitors are skipped (incompatible conditions field in newer Kuma).
-- Group hierarchy is preserved: groups are synced first, then child
-  monitors are linked to the correct parent group on the target.
+- Group hierarchy is preserved, including nested groups: groups are synced
+  parents-first, and every group and monitor is linked to its parent
+  through the source->target ID map built from the add responses, so the
+  target monitor list is fetched only once.
 - Paused monitors stay paused on the target.
 - All existing notifications on the target are attached to every synced monitor.
 """
@@ -77,6 +79,35 @@ def _get_all_target_notification_ids(api: UptimeKumaApi) -> List[int]:
     return [n["id"] for n in notifications]
 
 
+def plan_sync_order(groups: List[Dict], regular: List[Dict]) -> List[Dict]:
+    """
+    Return monitors in the order they must be created on the target:
+    groups topologically sorted (every parent before its children, at any
+    depth), then regular monitors.
+
+    A group whose parent is not among the synced groups, or that sits in a
+    parent cycle, is treated as top-level.
+    """
+    by_id = {g["id"]: g for g in groups}
+    depth: Dict[int, int] = {}
+
+    for grp in groups:
+        # Walk up until a group with a known depth, a non-group parent or a
+        # cycle, then assign depths on the way back down.
+        chain = []
+        cur = grp["id"]
+        while cur in by_id and cur not in depth and cur not in chain:
+            chain.append(cur)
+            cur = by_id[cur].get("parent")
+        base = depth.get(cur, -1)
+        for gid in reversed(chain):
+            base += 1
+            depth[gid] = base
+
+    ordered = sorted(groups, key=lambda g: depth[g["id"]])
+    return ordered + list(regular)
+
+
 def build_add_payload(
     src_monitor: Dict,
     parent_id: int = None,
@@ -297,13 +328,17 @@ def sync(
             src_regular.append(m)
 
     # ------------------------------------------------------------------
-    # Phase 1: sync groups first so we can map source→target group IDs
+    # Single pass over the plan: groups parents-first, then monitors.
+    # Target IDs of created/matched monitors are kept in memory, so the
+    # target list is fetched only once.
     # ------------------------------------------------------------------
+    plan = plan_sync_order(src_groups, src_regular)
+
     tgt_monitors = target_api.get_monitors()
     tgt_index = index_by_name(tgt_monitors)
 
-    # source group name → target group id  (after creation / lookup)
-    group_name_to_target_id: Dict[str, int] = {}
+    # source monitor id → target monitor id  (after creation / lookup)
+    src_to_target_id: Dict[int, int] = {}
 
     created = 0
     skipped = 0
@@ -311,74 +346,17 @@ def sync(
     errors = 0
     paused_count = 0
 
-    for grp in src_groups:
-        name = grp.get("name")
-        if not name:
-            continue
-
-        is_paused = not grp.get("active", True)
-        payload = build_add_payload(grp, notification_ids=target_notification_ids)
-
-        if name in tgt_index:
-            group_name_to_target_id[name] = tgt_index[name]["id"]
-            if update:
-                try:
-                    _edit_monitor_patched(
-                        target_api, tgt_index[name]["id"], payload
-                    )
-                    updated += 1
-                    print(f"[UPDATE] {name} (group)")
-                except Exception as e:
-                    errors += 1
-                    print(f"[ERROR]  {name}: {e}", file=sys.stderr)
-            else:
-                skipped += 1
-                print(f"[SKIP] {name} (group) already exists")
-            continue
-
-        try:
-            result = _add_monitor_patched(target_api, payload)
-            new_id = result["monitorID"]
-            group_name_to_target_id[name] = new_id
-            created += 1
-            print(f"[CREATE] {name} (group)")
-
-            # Pause the monitor if it was paused on source
-            if is_paused:
-                target_api.pause_monitor(new_id)
-                paused_count += 1
-                print(f"[PAUSE]  {name} (group)")
-
-        except Exception as e:
-            errors += 1
-            print(f"[ERROR]  {name}: {e}", file=sys.stderr)
-
-    # Build source group id → group name lookup (to resolve parent for children)
-    src_group_id_to_name: Dict[int, str] = {
-        g["id"]: g["name"] for g in src_groups if g.get("name")
-    }
-
-    # ------------------------------------------------------------------
-    # Phase 2: sync regular monitors, attaching them to correct groups
-    # ------------------------------------------------------------------
-    # Re-fetch target monitors to include newly created groups
-    tgt_monitors = target_api.get_monitors()
-    tgt_index = index_by_name(tgt_monitors)
-
-    for src in src_regular:
+    for src in plan:
         name = src.get("name")
         if not name:
             continue
 
+        is_group = _monitor_type_str(src) == "group"
+        label = f"{name} (group)" if is_group else name
         is_paused = not src.get("active", True)
 
-        # Resolve parent group on the target
-        target_parent_id = None
-        src_parent = src.get("parent")
-        if src_parent is not None:
-            parent_name = src_group_id_to_name.get(src_parent)
-            if parent_name and parent_name in group_name_to_target_id:
-                target_parent_id = group_name_to_target_id[parent_name]
+        # Resolve parent group on the target; parents are already handled
+        target_parent_id = src_to_target_id.get(src.get("parent"))
 
         payload = build_add_payload(
             src,
@@ -387,32 +365,35 @@ def sync(
         )
 
         if name in tgt_index:
+            src_to_target_id[src["id"]] = tgt_index[name]["id"]
             if update:
                 try:
                     _edit_monitor_patched(
                         target_api, tgt_index[name]["id"], payload
                     )
                     updated += 1
-                    print(f"[UPDATE] {name}")
+                    print(f"[UPDATE] {label}")
                 except Exception as e:
                     errors += 1
                     print(f"[ERROR]  {name}: {e}", file=sys.stderr)
             else:
                 skipped += 1
-                print(f"[SKIP] {name} already exists")
+                print(f"[SKIP] {label} already exists")
             continue
 
         try:
             result = _add_monitor_patched(target_api, payload)
             new_id = result["monitorID"]
+            src_to_target_id[src["id"]] = new_id
+            tgt_index[name] = {"id": new_id, "name": name}
             created += 1
-            print(f"[CREATE] {name}")
+            print(f"[CREATE] {label}")
 
             # Pause the monitor if it was paused on source
             if is_paused:
                 target_api.pause_monitor(new_id)
                 paused_count += 1
-                print(f"[PAUSE]  {name}")
+                print(f"[PAUSE]  {label}")
 
         except Exception as e:
             errors += 1